@@ -15,9 +15,7 @@ def download(artist, title):
         return "Lyrics not found."
 
     # remove leading newlines
-    while lyrics[:1] in ("\n"):
-        lyrics = lyrics[1:]
-    return lyrics
+    return lyrics.lstrip("\n")
 
 
 if __name__ == "__main__":
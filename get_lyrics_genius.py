@@ -1,9 +1,28 @@
+import re
+
 import lyricsgenius
 from requests.exceptions import ConnectionError as requests_ConnectionError
 
 # https://github.com/johnwmillr/LyricsGenius
 
 blacklist = ["Contributors"]
+junk = re.compile("Embed|Share URLCopyCopy|You might also like")
+clients = {}
+
+
+def get_client(token, clear_headers=False):
+    """Returns genius client, reused between calls so its connection pool is kept.
+    Client is never modified after creation, so it can be used from multiple threads."""
+    key = (token, clear_headers)
+    genius = clients.get(key)
+    if genius is None:
+        genius = lyricsgenius.Genius(token)
+        genius.remove_section_headers = clear_headers
+        genius.excluded_terms = ["(Remix)", "instrumental"]
+        genius.skip_non_songs = True
+        genius.verbose = False
+        clients[key] = genius
+    return genius
 
 
 def download(artist, title, token, clear_headers=False):
@@ -11,11 +30,7 @@ def download(artist, title, token, clear_headers=False):
     # setup genius
     if not token:
         return "No Genius API token provided."
-    genius = lyricsgenius.Genius(token)
-    genius.remove_section_headers = clear_headers
-    genius.excluded_terms = ["(Remix)", "instrumental"]
-    genius.skip_non_songs = True
-    genius.verbose = False
+    genius = get_client(token, clear_headers)
 
     # download lyrics
     genius_title = ""
@@ -31,37 +46,22 @@ def download(artist, title, token, clear_headers=False):
 
     # clean lyrics
     lyrics = lyrics.replace(genius_title + " Lyrics", "")
-    lyrics = lyrics.replace("Embed", "")
-    lyrics = lyrics.replace("Share URLCopyCopy", "")
-    lyrics = lyrics.replace("You might also like", "")
-    str_numbers = list(map(str, range(10)))
+    lyrics = junk.sub("", lyrics)
 
     # remove numbers
-    for n in range(3):
-        if lyrics[-1] in str_numbers:
-            lyrics = lyrics[:-1]
-
-    # remove lines containing blacklisted words
-    lyrics_split = lyrics.split("\n")
-    lyrics_new = ""
-    not_lyrics = False
-    for line in lyrics_split:
-        if len(line) > 500:
-            not_lyrics = True
-            break
-        if any([x not in line for x in blacklist]):
-            lyrics_new += line + "\n"
-    lyrics = lyrics_new
+    lyrics = lyrics.rstrip("0123456789")
 
     # remove lyrics with single line longer than 500 characters
     # its probably not lyrics
-    if not_lyrics:
+    lyrics_split = lyrics.split("\n")
+    if any(len(line) > 500 for line in lyrics_split):
         return "Lyrics not found."
 
+    # remove lines containing blacklisted words
+    lyrics = "\n".join(line for line in lyrics_split if not any(x in line for x in blacklist))
+
     # remove leading newlines
-    while lyrics[:1] == "\n":
-        lyrics = lyrics[1:]
-    return lyrics
+    return lyrics.lstrip("\n")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# downloaded lyrics are stored in files named by hash of artist, title,
+# source they are downloaded from and whether headers are cleared
+
+cache_dir = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "cmus-auto-lyrics",
+)
+cache_ttl = 30 * 24 * 60 * 60   # seconds
+memory_size = 256
+memory = OrderedDict()
+memory_lock = threading.Lock()   # cache is also used from prefetch thread
+
+
+def cache_path(key):
+    """Returns path to cache file for given key"""
+    name = hashlib.sha1("\x1f".join(map(str, key)).encode()).hexdigest()
+    return os.path.join(cache_dir, name + ".txt")
+
+
+def remember(key, lyrics):
+    """Stores lyrics in in-memory cache, dropping least recently used ones"""
+    with memory_lock:
+        memory[key] = lyrics
+        memory.move_to_end(key)
+        if len(memory) > memory_size:
+            memory.popitem(last=False)
+
+
+def load(artist, title, source, clear_headers=False):
+    """Returns cached lyrics, or None if they are not cached or are too old"""
+    key = (artist, title, source, clear_headers)
+    with memory_lock:
+        if key in memory:
+            memory.move_to_end(key)
+            return memory[key]
+    path = cache_path(key)
+    try:
+        if time.time() - os.path.getmtime(path) > cache_ttl:
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            lyrics = f.read()
+    except OSError:
+        return None
+    remember(key, lyrics)
+    return lyrics
+
+
+def save(artist, title, source, clear_headers, lyrics):
+    """Stores lyrics in cache, file is written atomically"""
+    key = (artist, title, source, clear_headers)
+    remember(key, lyrics)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(lyrics)
+        os.replace(tmp_path, cache_path(key))
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
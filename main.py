@@ -1,15 +1,29 @@
 import argparse
 import curses
+import functools
 import os
+import queue
 import signal
+import socket
 import subprocess
 import sys
+import threading
 import time
 
 import music_tag
+from mutagen import MutagenError
 
 import get_lyrics_azlyrics
 import get_lyrics_genius
+import lyrics_cache
+
+NOT_LYRICS = frozenset((
+    "No internet connection.",
+    "No Genius API token provided.",
+    "No lyrics tag. Running in offline mode.",
+    "Lyrics not found.",
+))
+cmus_socket = None
 
 
 class UI:
@@ -18,55 +32,84 @@ class UI:
     def __init__(self, screen):
         curses.use_default_colors()
         curses.curs_set(0)
-        screen.nodelay(True)
+        screen.timeout(200)   # getch blocks for at most 200ms
         self.screen = screen
         self.lines = []
+        self.lines_per_second = 0
         self.position = 0
         self.position_old = 0
+        self.dirty = True
+        self.drawn_state = None
+        self.rows = []
+        self.line_rows = []
+        self.pad = None
+        self.pad_size = None
+
+
+    def update_lyrics(self, lyrics, song_duration):
+        """Loads lyrics, and precomputes number of lines per second of song"""
+        self.lines = lyrics.splitlines()
+        if song_duration:
+            self.lines_per_second = len(self.lines) / song_duration
+        else:
+            self.lines_per_second = 0
+        self.dirty = True
+        self.pad_size = None
 
 
-    def update_lyrics(self, lyrics):
-        """Loads lyrics"""
-        self.lines = lyrics.split("\n")
-        self.screen.clear()
-
-
-    def scroll(self, song_duration, song_position):
-        """Scrolls lyrics to position given from song duration"""
-        line_index = int((song_position * len(self.lines) / song_duration))
+    def scroll(self, song_position):
+        """Scrolls lyrics to position given from song duration.
+        Returns True if lyrics are redrawn."""
+        line_index = int(song_position * self.lines_per_second)
         h, _ = self.screen.getmaxyx()
         self.position = max(0, line_index - int(h / 2))
         if self.position != self.position_old:
             self.position_old = self.position
             self.draw()
+            return True
+        return False
+
+
+    def wrap(self, h, w):
+        """Wraps lyrics lines to screen width, remembers first row of each line,
+        and draws all rows on pad, with one blank screen of rows after them"""
+        width = max(w - 1, 3)
+        self.rows = []
+        self.line_rows = []
+        for line in self.lines:
+            self.line_rows.append(len(self.rows))
+            while len(line) >= width:
+                self.rows.append(line[:width])
+                line = "  " + line[width:]
+            self.rows.append(line)
+        self.pad = curses.newpad(len(self.rows) + h, w)
+        for row_num, row in enumerate(self.rows):
+            self.pad.insstr(row_num, 0, row)
+        self.pad_size = (h, w)
 
 
     def draw(self):
-        """Draws lyrics on screen"""
+        """Draws lyrics on screen, if anything has changed since last draw"""
         h, w = self.screen.getmaxyx()
-        line_num = 0
-        for line in self.lines[self.position:]:
-            while len(line) >= w - 1:
-                if line_num < h:
-                    self.screen.insstr(line_num, 0, line[:w-1] + "\n")
-                    line = "  " + line[w - 1:]
-                    line_num += 1
-                else:
-                    break
-            if line_num < h:
-                self.screen.insstr(line_num, 0, line + "\n")
-            else:
-                break
-            line_num += 1
-        while line_num < h:
-            self.screen.insstr(line_num, 0, "\n")
-            line_num += 1
-        self.screen.refresh()
+        state = (self.position, h, w)
+        if not self.dirty and state == self.drawn_state:
+            return
+        if (h, w) != self.pad_size:
+            self.wrap(h, w)
+        if self.position < len(self.line_rows):
+            first_row = self.line_rows[self.position]
+        else:
+            first_row = len(self.rows)
+        # screen is refreshed first so it is not left pending after resize
+        self.screen.noutrefresh()
+        self.pad.noutrefresh(first_row, 0, 0, 0, h - 1, w - 1)
+        curses.doupdate()
+        self.dirty = False
+        self.drawn_state = state
 
 
     def wait_input(self):
         """Handles user input and window resizing"""
-        h, _ = self.screen.getmaxyx()
         input_key = self.screen.getch()
         if input_key == curses.KEY_UP:
             if self.position > 0:
@@ -80,6 +123,7 @@ class UI:
                 self.draw()
                 return True
         elif input_key == curses.KEY_RESIZE:
+            self.dirty = True
             self.draw()
             return False
         return False
@@ -87,26 +131,75 @@ class UI:
 
 def title_from_path(path):
     """Tries to get song artist and title from its path."""
-    song_name = os.path.splitext(path)[0].strip("/").split("/")
-    song_name_split = song_name[-1].split(" - ")
-    if len(song_name_split) < 2:
-        song_name_split = song_name[-1].split("-")
-    if len(song_name_split) >= 2:
-        artist = song_name_split[0]
-        title = song_name_split[1]
-    else:
-        artist = song_name[-2]
-        title = song_name[-1]
-    return artist, title
-
-
-def get_lyrics(song_path, token, clear_headers=False, offline=False, artist=None, title=None):
+    song_name = os.path.splitext(os.path.basename(path))[0]
+    artist, separator, title = song_name.partition(" - ")
+    if not separator:
+        artist, separator, title = song_name.partition("-")
+    if separator:
+        return artist.strip(), title.strip()
+    return os.path.basename(os.path.dirname(path)), song_name
+
+
+@functools.lru_cache(maxsize=8)
+def load_tags_cached(song_path, mtime):
+    """Loads song tags, recently loaded ones are reused"""
+    return music_tag.load_file(song_path)
+
+
+def load_tags(song_path):
+    """Loads song tags, reusing them only if file has not been modified since"""
+    try:
+        mtime = os.stat(song_path).st_mtime_ns
+    except OSError:
+        mtime = None
+    return load_tags_cached(song_path, mtime)
+
+
+def download_into(results, download, *args):
+    """Runs download and puts its result in queue, or None if it raised"""
+    try:
+        lyrics = download(*args)
+    except Exception:
+        lyrics = None
+    results.put(lyrics)
+
+
+def download_lyrics(artist, title, token, clear_headers=False, parallel=False):
+    """Downloads lyrics from genius if token is provided, otherwise from azlyrics.
+    In parallel mode both are queried at once, and first found lyrics are used."""
+    if not token:
+        return get_lyrics_azlyrics.download(artist, title)
+    if not parallel:
+        return get_lyrics_genius.download(artist, title, token, clear_headers)
+    # daemon threads, so slower download does not keep program from exiting
+    results = queue.Queue()
+    downloads = (
+        (get_lyrics_genius.download, artist, title, token, clear_headers),
+        (get_lyrics_azlyrics.download, artist, title),
+    )
+    for args in downloads:
+        threading.Thread(target=download_into, args=(results, *args), daemon=True).start()
+    lyrics = "Lyrics not found."
+    for _ in downloads:
+        result = results.get()
+        if result is None:
+            # failed source is treated as not found, other one may still find lyrics
+            continue
+        lyrics = result
+        if lyrics not in NOT_LYRICS:
+            break
+    return lyrics
+
+
+def get_lyrics(song_path, token, clear_headers=False, offline=False, artist=None, title=None, parallel=False):
     """Tries to get song lyrics from tags then from web,
     by reading artist and title from tags,
-    alternatively guessing them from song file path and name."""
-    tags = music_tag.load_file(song_path)
-    if len(str(tags["lyrics"])) > 12:
-        lyrics = str(tags["lyrics"])
+    alternatively guessing them from song file path and name.
+    Loaded tags are returned too, so they can be reused."""
+    tags = load_tags(song_path)
+    lyrics_tag = tags["lyrics"].first
+    if lyrics_tag and len(lyrics_tag) > 12:
+        lyrics = str(lyrics_tag)
     else:
         lyrics = None
     if not artist:
@@ -122,43 +215,136 @@ def get_lyrics(song_path, token, clear_headers=False, offline=False, artist=None
     if not lyrics:
         if offline:
             lyrics = "No lyrics tag. Running in offline mode."
-        elif token:
-            lyrics = get_lyrics_genius.download(artist, title, token, clear_headers)
         else:
-            lyrics = get_lyrics_azlyrics.download(artist, title)
-    return lyrics, artist, title
+            if not token:
+                source = "azlyrics"
+            elif parallel:
+                source = "genius+azlyrics"
+            else:
+                source = "genius"
+            lyrics = lyrics_cache.load(artist, title, source, clear_headers)
+            if not lyrics:
+                lyrics = download_lyrics(artist, title, token, clear_headers, parallel)
+                if lyrics not in NOT_LYRICS:
+                    lyrics_cache.save(artist, title, source, clear_headers, lyrics)
+    return lyrics, artist, title, tags
+
+
+def cmus_socket_path():
+    """Gets path to cmus control socket, the same way cmus does"""
+    if os.environ.get("CMUS_SOCKET"):
+        return os.environ["CMUS_SOCKET"]
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "cmus-socket")
+    config_dir = os.environ.get("CMUS_HOME")
+    if not config_dir:
+        config_dir = os.path.join(
+            os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config"),
+            "cmus",
+        )
+    return os.path.join(config_dir, "socket")
+
+
+def cmus_command(command):
+    """Sends command to cmus over its control socket and returns the answer.
+    Socket is kept open between calls. Returns None if socket is not available."""
+    global cmus_socket
+    try:
+        if cmus_socket is None:
+            cmus_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            cmus_socket.settimeout(1)
+            cmus_socket.connect(cmus_socket_path())
+        cmus_socket.sendall(command.encode() + b"\n")
+        # answer is terminated with empty line
+        answer = cmus_socket.recv(4096)
+        while answer != b"\n" and not answer.endswith(b"\n\n"):
+            data = cmus_socket.recv(4096)
+            if not data:
+                raise ConnectionError("cmus closed the socket")
+            answer += data
+    except OSError:
+        if cmus_socket:
+            cmus_socket.close()
+        cmus_socket = None
+        return None
+    return answer.decode()
 
 
 def cmus_status():
-    """Gets song path, duration and position from cmus-remote"""
-    proc = subprocess.Popen(["cmus-remote", "-Q"],
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE)
-    output, error = proc.communicate()
-    if error:
-        print(error.decode())
-        return None, None, None
-    status = output.decode().split("\n")
-    for line in status:
-        line_split = line.split(" ")
-        if line_split[0] == "file":
-            song_path = line[5:]
-        elif line_split[0] == "duration":
-            duration = int(line_split[1:][0])
-        elif line_split[0] == "position":
-            position = int(line_split[1:][0])
+    """Gets song path, duration and position from cmus socket, or from cmus-remote"""
+    output = cmus_command("status")
+    if output is None:
+        proc = subprocess.run(("cmus-remote", "-Q"), capture_output=True, text=True)
+        if proc.stderr:
+            print(proc.stderr)
+            return None, None, None
+        output = proc.stdout
+    song_path = duration = position = None
+    missing = 3
+    for line in output.splitlines():
+        key, _, value = line.partition(" ")
+        if key == "file":
+            song_path = value
+            missing -= 1
+        elif key == "duration":
+            duration = int(value)
+            missing -= 1
+        elif key == "position":
+            position = int(value)
+            missing -= 1
+        # cmus sends these right after status line, so rest can be skipped
+        if not missing:
+            break
     return song_path, duration, position
 
 
-def fill_tags(song_path, lyrics, artist, title):
+def cmus_next_in_queue():
+    """Gets path of first song in cmus queue from cmus socket, or from cmus-remote"""
+    output = cmus_command("save -q -")
+    if output is None:
+        proc = subprocess.run(("cmus-remote", "-C", "save -q -"), capture_output=True, text=True)
+        if proc.stderr:
+            return None
+        output = proc.stdout
+    for line in output.splitlines():
+        if line:
+            return line
+    return None
+
+
+def prefetch_lyrics(song_path, token, clear_headers=False, parallel=False):
+    """Gets lyrics in background, so they are cached when song starts playing"""
+    try:
+        get_lyrics(song_path, token, clear_headers, parallel=parallel)
+    except Exception:
+        pass
+
+
+def prefetch_next(token, clear_headers=False, parallel=False):
+    """Starts prefetching lyrics for next song in cmus queue"""
+    next_path = cmus_next_in_queue()
+    if next_path:
+        threading.Thread(
+            target=prefetch_lyrics,
+            args=(next_path, token, clear_headers, parallel),
+            daemon=True,
+        ).start()
+
+
+def fill_tags(tags, lyrics, artist, title):
     """Saves lyrics, artist, and title tags, if lyrics tag is missing."""
-    tags = music_tag.load_file(song_path)
-    if len(str(tags["lyrics"])) < 16:
+    lyrics_tag = tags["lyrics"].first
+    if not lyrics_tag or len(lyrics_tag) < 16:
         tags["lyrics"] = lyrics
         if not tags["artist"].first:
             tags["artist"] = artist
         if not tags["title"].first:
             tags["title"] = title
+        try:
+            tags.save()
+        except (OSError, MutagenError):
+            # file is left as it was, so cached tags holding new values are dropped
+            load_tags_cached.cache_clear()
 
 
 def main(screen, args):
@@ -168,6 +354,8 @@ def main(screen, args):
     save_tags = args.save_tags
     auto_scroll = args.auto_scroll
     offline = args.offline
+    parallel = args.parallel
+    prefetch = args.prefetch and not offline
 
     ui = UI(screen)
     run = False
@@ -175,47 +363,44 @@ def main(screen, args):
     song_path, duration, position = cmus_status()
     if not song_path:
         sys.exit()
-    lyrics, artist, title = get_lyrics(song_path, token, clear_headers, offline)
-    ui.update_lyrics(lyrics)
-    ui.scroll(duration, position)
-    ui.draw()
+    lyrics, artist, title, tags = get_lyrics(song_path, token, clear_headers, offline, parallel=parallel)
+    ui.update_lyrics(lyrics, duration)
+    if not ui.scroll(position):
+        ui.draw()
+    if prefetch:
+        prefetch_next(token, clear_headers, parallel)
 
     song_path_old = song_path
     position_old = position
 
-    delay = 0.05
     check_status_s = 1
-    check_status = int(check_status_s / delay)
-    timer = 0
+    status_time = time.monotonic()
     disable_auto_scroll = False
     run = True
     while run:
-        if timer >= check_status:
+        if time.monotonic() - status_time >= check_status_s:
             song_path, duration, position = cmus_status()
-            timer = 0
+            status_time = time.monotonic()
         if song_path != song_path_old:
             if not song_path:
                 break
             song_path_old = song_path
-            lyrics, artist, title = get_lyrics(song_path, token, clear_headers, offline)
-            ui.update_lyrics(lyrics)
+            lyrics, artist, title, tags = get_lyrics(song_path, token, clear_headers, offline, parallel=parallel)
+            ui.update_lyrics(lyrics, duration)
             ui.draw()
             disable_auto_scroll = False
+            if prefetch:
+                prefetch_next(token, clear_headers, parallel)
             if save_tags:
-                if lyrics not in ("No internet connection.",
-                                  "No Genius API token provided.",
-                                  "No lyrics tag. Running in offline mode."):
-                    fill_tags(song_path, lyrics, artist, title)
+                if lyrics not in NOT_LYRICS:
+                    fill_tags(tags, lyrics, artist, title)
         if auto_scroll and not disable_auto_scroll:
             if position != position_old:
                 position_old = position
-                ui.scroll(duration, position)
-                ui.draw()
+                ui.scroll(position)
         key_pressed = ui.wait_input()
         if key_pressed:
             disable_auto_scroll = True
-        timer += 1
-        time.sleep(delay)
 
 
 def sigint_handler(signum, frame):
@@ -260,6 +445,18 @@ def argparser():
         action="store_true",
         help="runs in offline mode - only reads lyrics from tags",
     )
+    parser.add_argument(
+        "-p",
+        "--parallel",
+        action="store_true",
+        help="download from genius and azlyrics in parallel, use first found lyrics",
+    )
+    parser.add_argument(
+        "-n",
+        "--prefetch",
+        action="store_true",
+        help="download lyrics for first song in cmus queue in background",
+    )
     parser.add_argument(
         "-v",
         "--version",